@@ -2,15 +2,30 @@
 # Enhanced Python script using Gemini API to generate and edit text like Gemini Canvas
 
 import google.generativeai as genai
-from fastapi import FastAPI, Request, HTTPException
+from google.generativeai import client as genai_client
+from google.api_core.exceptions import InternalServerError, ResourceExhausted, ServiceUnavailable
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 import uvicorn
 import os
-from typing import Optional
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Awaitable, Callable, Literal, Optional, get_args
 import logging
 import dotenv
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 dotenv.load_dotenv()
 
 # Configure logging
@@ -28,11 +43,370 @@ genai.configure(api_key=API_KEY)
 # Step 2: Initialize model
 model = genai.GenerativeModel("gemini-2.5-flash")
 
+# Cap concurrent outbound Gemini calls per worker; excess requests wait here
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONC", "20"))
+GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_CONCURRENT)
+
+# Retry transient Gemini failures (429/500/503) with exponential backoff and jitter
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+RETRYABLE_ERRORS = (ResourceExhausted, InternalServerError, ServiceUnavailable)
+
+def log_retry(retry_state) -> None:
+    logger.warning(
+        "Gemini call failed (%s), retrying in %.1fs",
+        retry_state.outcome.exception(),
+        retry_state.next_action.sleep,
+    )
+
+async def retry_transient(call: Callable[[], Awaitable]):
+    """Await call(), retrying errors in RETRYABLE_ERRORS with backoff"""
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+        wait=wait_exponential_jitter(initial=0.5, max=8),
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        before_sleep=log_retry,
+        reraise=True,
+    ):
+        with attempt:
+            return await call()
+
+async def gemini_generate(prompt: str, **kwargs):
+    """Call generate_content_async under the concurrency cap, retrying transient errors"""
+    async def call():
+        # Acquire per attempt so backoff sleeps don't hold a slot
+        async with GEMINI_SEM:
+            return await model.generate_content_async(prompt, **kwargs)
+    return await retry_transient(call)
+
+async def gemini_stream(prompt: str):
+    """Yield streamed response chunks, holding a concurrency slot until the stream is read"""
+    # generate_content_async(stream=True) returns after the first chunk while the upstream
+    # call stays open, so the slot has to cover the whole iteration
+    async with GEMINI_SEM:
+        response = await retry_transient(
+            lambda: model.generate_content_async(prompt, stream=True)
+        )
+        async for chunk in response:
+            yield chunk
+
+FinishReason = genai.protos.Candidate.FinishReason
+
+# Response cache: identical requests are answered without calling Gemini
+CACHE_MAX_ENTRIES = 1024
+
+class ResponseCache:
+    """Exact-match LRU cache of generated text"""
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return "|".join(parts)
+
+    async def get(self, key: str) -> Optional[str]:
+        async with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    async def set(self, key: str, value: str) -> None:
+        async with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def clear(self) -> None:
+        async with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+response_cache = ResponseCache()
+
+# Semantic cache: paraphrased prompts reuse a previous response. Off unless SEMANTIC_CACHE=1,
+# since a near match can return the result for a text that differs in names, numbers or a
+# negation. Needs: pip install sentence-transformers faiss-cpu
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+class SemanticCache:
+    """Embedding similarity cache with one FAISS index per action/style bucket"""
+
+    def __init__(self, model_name: str, threshold: float, maxsize: int = CACHE_MAX_ENTRIES):
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self.encoder = SentenceTransformer(model_name)
+        self.dim = self.encoder.get_sentence_embedding_dimension()
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._buckets: dict = {}  # bucket -> (faiss.IndexFlatIP, list of responses)
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def embed(self, text: str):
+        # Encoding is CPU-bound, keep it off the event loop
+        return await asyncio.to_thread(
+            self.encoder.encode, [text], normalize_embeddings=True
+        )
+
+    async def get(self, bucket: str, vector) -> Optional[str]:
+        async with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is not None and entry[0].ntotal:
+                scores, ids = entry[0].search(vector, 1)
+                if scores[0][0] > self.threshold:
+                    self.hits += 1
+                    return entry[1][ids[0][0]]
+            self.misses += 1
+            return None
+
+    async def set(self, bucket: str, vector, value: str) -> None:
+        async with self._lock:
+            index, responses = self._buckets.setdefault(
+                bucket, (self._faiss.IndexFlatIP(self.dim), [])
+            )
+            # Flat indexes can't evict single entries; start the bucket over when full
+            if index.ntotal >= self.maxsize:
+                index.reset()
+                responses.clear()
+            index.add(vector)
+            responses.append(value)
+
+    async def clear(self) -> None:
+        async with self._lock:
+            self._buckets.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": sum(index.ntotal for index, _ in self._buckets.values()),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+# Built in the startup hook so importing the module never loads or downloads the model
+semantic_cache: Optional[SemanticCache] = None
+
+# Single-flight: concurrent identical requests share one Gemini call
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one in-flight future"""
+
+    def __init__(self):
+        self._inflight: "dict[str, asyncio.Future]" = {}
+        self._lock = asyncio.Lock()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        async with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = asyncio.get_running_loop().create_future()
+                self._inflight[key] = fut
+
+        if not leader:
+            # Shield so a cancelled follower doesn't cancel the shared call
+            return await asyncio.shield(fut)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                # Followers weren't cancelled themselves; give them an HTTP error instead
+                e = HTTPException(status_code=503, detail="Upstream call was cancelled, please retry")
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when there are no followers
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            # No await here, so a cancelled leader can't skip the cleanup
+            self._inflight.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+single_flight = SingleFlight()
+
+# Micro-batching: concurrent /process prompts with the same action/style share one Gemini call.
+# Off by default (BATCH_MAX_SIZE=1): batching puts texts from different clients in one prompt,
+# and a solo request waits up to BATCH_MAX_WAIT for company.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", "0.02"))
+
+class BatchItem(BaseModel):
+    id: int
+    result: str
+
+BATCH_RESPONSE_ADAPTER = TypeAdapter(list[BatchItem])
+
+class MicroBatcher:
+    """Collect prompts for a short window and send them to Gemini as one numbered list"""
+
+    def __init__(self, max_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queues: "dict[str, asyncio.Queue]" = {}
+        self._tasks: set = set()
+
+    def start(self, keys) -> None:
+        """Start one worker per batch key on the running loop"""
+        if self.max_size <= 1:
+            return
+        for key in keys:
+            queue = self._queues[key] = asyncio.Queue()
+            self._spawn(self._worker(queue))
+
+    async def stop(self) -> None:
+        """Cancel the workers and any batches still running"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for queue in self._queues.values():
+            while not queue.empty():
+                self._cancel_items([queue.get_nowait()])
+        self._queues.clear()
+
+    async def submit(self, key: str, prompt: str) -> str:
+        """Queue a prompt under a batch key and wait for its text"""
+        queue = self._queues.get(key)
+        if queue is None:
+            # Batching disabled or workers not started: call Gemini directly
+            response = await gemini_generate(prompt)
+            return response.text
+
+        fut = asyncio.get_running_loop().create_future()
+        await queue.put((prompt, fut))
+        return await fut
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, queue: asyncio.Queue) -> list:
+        items = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        try:
+            while len(items) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            self._cancel_items(items)
+            raise
+        return items
+
+    @staticmethod
+    def _cancel_items(items: list) -> None:
+        for _, fut in items:
+            fut.cancel()
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            items = await self._drain(queue)
+            # Run the batch separately so the next window starts filling immediately
+            self._spawn(self._run_batch(items))
+
+    async def _run_batch(self, items: list) -> None:
+        prompts = [prompt for prompt, _ in items]
+        try:
+            if len(prompts) == 1:
+                response = await gemini_generate(prompts[0])
+                results = [response.text]
+            else:
+                results = await self._generate_packed(prompts)
+        except asyncio.CancelledError:
+            self._cancel_items(items)
+            raise
+        except Exception as e:
+            results = [e] * len(items)
+
+        for (_, fut), result in zip(items, results):
+            if fut.done():
+                continue
+            if isinstance(result, BaseException):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+    async def _generate_packed(self, prompts: list) -> list:
+        numbered = "\n".join(f"{i}. {json.dumps(p)}" for i, p in enumerate(prompts, 1))
+        packed = (
+            "Process each numbered item independently. Return one object per item with its "
+            "number as id and its result:\n" + numbered
+        )
+        response = await gemini_generate(
+            packed,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": list[BatchItem],
+            },
+        )
+        try:
+            items = BATCH_RESPONSE_ADAPTER.validate_json(response.text)
+        except (ValueError, TypeError):
+            items = []
+        by_id = {item.id: item.result for item in items}
+        expected = range(1, len(prompts) + 1)
+        if len(items) == len(prompts) and set(by_id) == set(expected) and all(by_id.values()):
+            return [by_id[i] for i in expected]
+
+        # The model didn't return a usable list; answer each prompt on its own
+        logger.warning("Batched response unusable for %d prompts, retrying individually", len(prompts))
+        responses = await asyncio.gather(
+            *[gemini_generate(p) for p in prompts], return_exceptions=True
+        )
+        return [self._text_or_error(r) for r in responses]
+
+    @staticmethod
+    def _text_or_error(response):
+        # .text raises for blocked replies; keep that error in this item's slot only
+        if isinstance(response, BaseException):
+            return response
+        try:
+            return response.text
+        except ValueError as e:
+            return e
+
+micro_batcher = MicroBatcher()
+
 # Step 3: Create FastAPI app
 app = FastAPI(
     title="Gemini Canvas App",
     description="A text processing API using Gemini AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS more securely
@@ -44,72 +418,280 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress generated text; SSE responses are left uncompressed so chunks aren't held back
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
+# Gemini connection lifecycle: the SDK shares one gRPC (HTTP/2) channel per process,
+# so open it before the first request and close it cleanly on shutdown
+GEMINI_WARMUP_TIMEOUT = float(os.getenv("GEMINI_WARMUP_TIMEOUT", "10"))
+
+@app.on_event("startup")
+async def open_gemini_channel():
+    channel = genai_client.get_default_generative_async_client().transport.grpc_channel
+    try:
+        await asyncio.wait_for(channel.channel_ready(), GEMINI_WARMUP_TIMEOUT)
+        logger.info("Gemini channel ready")
+    except asyncio.TimeoutError:
+        # Not fatal; the channel keeps connecting in the background
+        logger.warning("Gemini channel not ready after %ss", GEMINI_WARMUP_TIMEOUT)
+    except Exception as e:
+        logger.warning("Gemini channel warm-up failed: %s", e)
+
+@app.on_event("startup")
+async def start_micro_batcher():
+    micro_batcher.start(
+        ResponseCache.make_key(action, style) for action in PROMPT_TEMPLATES for style in ("", *STYLES)
+    )
+
+@app.on_event("shutdown")
+async def stop_micro_batcher():
+    await micro_batcher.stop()
+
+@app.on_event("startup")
+async def open_semantic_cache():
+    global semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    try:
+        # Loading the encoder may download weights; keep it off the event loop
+        semantic_cache = await asyncio.to_thread(
+            SemanticCache, SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_THRESHOLD
+        )
+        logger.info("Semantic cache enabled (threshold %s)", SEMANTIC_CACHE_THRESHOLD)
+    except Exception as e:
+        logger.warning("Semantic cache disabled: %s", e)
+
+@app.on_event("shutdown")
+async def close_gemini_channel():
+    await genai_client.get_default_generative_async_client().transport.close()
+    # Drop the closed client so a later startup in this process builds a fresh channel
+    genai_client._client_manager.clients.pop("generative_async", None)
+    model._async_client = None
+
+# Prompt templates for /process, formatted once per request. The instruction prefixes are
+# a few tokens long, far below the minimum size Gemini accepts for context caching
+# (1,024 tokens on gemini-2.5-flash), so they are sent inline rather than as cached_content.
+PROMPT_TEMPLATES = {
+    "rewrite": "Rewrite the following text in a clear, concise manner{style_modifier}:\n\n{text}",
+    "summarize": "Summarize the following text concisely{style_modifier}:\n\n{text}",
+    "expand": "Expand the following into more detailed content{style_modifier}:\n\n{text}",
+    "improve": "Improve the following text for clarity and engagement{style_modifier}:\n\n{text}",
+    "simplify": "Simplify the following text to make it easier to understand{style_modifier}:\n\n{text}",
+}
+
+Style = Literal["formal", "casual", "professional", "creative"]
+STYLES = get_args(Style)
+
+MAX_TEXT_LENGTH = 20000
+
 # Request models
 class TextRequest(BaseModel):
-    text: str
-    action: str  # 'rewrite', 'summarize', 'expand', 'improve', 'simplify'
-    style: Optional[str] = None  # 'formal', 'casual', 'professional', 'creative'
+    text: str = Field(max_length=MAX_TEXT_LENGTH)
+    action: Literal["rewrite", "summarize", "expand", "improve", "simplify"]
+    style: Optional[Style] = None
+
+    @field_validator("text")
+    @classmethod
+    def text_not_blank(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("Text cannot be empty")
+        return v
+
+    @field_validator("style", mode="before")
+    @classmethod
+    def empty_style_is_default(cls, v):
+        # The frontend sends "" for the default style
+        return v or None
 
 class GenerateRequest(BaseModel):
     prompt: str
     max_tokens: Optional[int] = 1000
 
-# Step 4: Enhanced text manipulation endpoint
-@app.post("/process")
-async def process_text(req: TextRequest):
-    """Process text with various actions and styles"""
-    
-    if not req.text.strip():
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
+    @field_validator("prompt")
+    @classmethod
+    def prompt_not_blank(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("Prompt cannot be empty")
+        return v
+
+def build_process_prompt(req: TextRequest) -> str:
+    """Build the Gemini prompt for a text processing request"""
     # Enhanced prompt mapping with style considerations
     style_modifier = ""
     if req.style:
         style_modifier = f" Make the tone {req.style}."
     
-    prompt_map = {
-        "rewrite": f"Rewrite the following text in a clear, concise manner{style_modifier}:\n\n{req.text}",
-        "summarize": f"Summarize the following text concisely{style_modifier}:\n\n{req.text}",
-        "expand": f"Expand the following into more detailed content{style_modifier}:\n\n{req.text}",
-        "improve": f"Improve the following text for clarity and engagement{style_modifier}:\n\n{req.text}",
-        "simplify": f"Simplify the following text to make it easier to understand{style_modifier}:\n\n{req.text}",
-    }
-    
-    prompt = prompt_map.get(req.action)
-    if not prompt:
-        raise HTTPException(status_code=400, detail=f"Unsupported action: {req.action}")
+    return PROMPT_TEMPLATES[req.action].format(style_modifier=style_modifier, text=req.text)
 
+async def stream_gemini(prompt: str, cache_key: str, no_cache: bool):
+    """Yield Gemini output as server-sent events, caching the full text at the end"""
+    if not no_cache:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            yield f"data: {json.dumps({'t': cached})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+            return
+
+    parts = []
+    finish_reason = FinishReason.FINISH_REASON_UNSPECIFIED
     try:
-        response = model.generate_content(prompt)
-        if not response.text:
-            raise HTTPException(status_code=500, detail="No response generated")
-        
-        logger.info(f"Successfully processed text with action: {req.action}")
-        return {"result": response.text, "action": req.action, "style": req.style}
-    
+        async with aclosing(gemini_stream(prompt)) as chunks:
+            async for chunk in chunks:
+                block_reason = chunk.prompt_feedback.block_reason
+                if block_reason:
+                    raise ValueError(f"prompt was blocked ({block_reason.name})")
+                if not chunk.candidates:
+                    continue
+                candidate = chunk.candidates[0]
+                if candidate.finish_reason:
+                    finish_reason = candidate.finish_reason
+                # Read parts directly: chunk.text also raises for safety-stopped output
+                text = "".join(part.text for part in candidate.content.parts if "text" in part)
+                if text:
+                    parts.append(text)
+                    yield f"data: {json.dumps({'t': text})}\n\n"
+        if finish_reason != FinishReason.STOP:
+            # Blocked or truncated output must not be cached as a complete answer
+            raise ValueError(f"generation stopped early ({FinishReason(finish_reason).name})")
     except Exception as e:
-        logger.error(f"Error processing text: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing text: {str(e)}")
+        logger.error("Error streaming content: %s", e)
+        yield f"event: error\ndata: {json.dumps({'detail': f'Error streaming content: {str(e)}'})}\n\n"
+        return
+
+    if parts:
+        await response_cache.set(cache_key, "".join(parts))
+    yield "event: done\ndata: {}\n\n"
+
+async def cached_single_flight(
+    cache_key: str,
+    produce: Callable[[], Awaitable[str]],
+    context: str,
+    empty_detail: str,
+    no_cache: bool = False,
+) -> str:
+    """Return cached text for cache_key, or run produce() once for all concurrent callers"""
+    if not no_cache:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    async def call() -> str:
+        text = await produce()
+        if not text:
+            raise HTTPException(status_code=500, detail=empty_detail)
+        await response_cache.set(cache_key, text)
+        return text
+
+    try:
+        return await single_flight.do(cache_key, call)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error %s: %s", context, e)
+        raise HTTPException(status_code=500, detail=f"Error {context}: {str(e)}")
+
+async def run_process(req: TextRequest, prompt: str, no_cache: bool) -> dict:
+    """Answer a validated text processing request from the caches or Gemini"""
+    bucket = ResponseCache.make_key(req.action, req.style or "")
+
+    async def produce() -> str:
+        vector = None
+        if semantic_cache is not None:
+            vector = await semantic_cache.embed(prompt)
+            if not no_cache:
+                cached = await semantic_cache.get(bucket, vector)
+                if cached is not None:
+                    return cached
+        text = await micro_batcher.submit(bucket, prompt)
+        if text and vector is not None:
+            await semantic_cache.set(bucket, vector, text)
+        return text
+
+    cache_key = ResponseCache.make_key(req.action, req.style or "", req.text)
+    result = await cached_single_flight(
+        cache_key, produce, "processing text", "No response generated", no_cache
+    )
+    logger.info("processed action=%s", req.action)
+    return {"result": result, "action": req.action, "style": req.style}
+
+# Background jobs: long prompts can be queued and polled instead of held open
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "600"))
+jobs: "dict[str, dict]" = {}
+
+def prune_jobs() -> None:
+    """Forget finished jobs older than JOB_TTL_SECONDS"""
+    cutoff = time.monotonic() - JOB_TTL_SECONDS
+    for job_id in [k for k, job in jobs.items() if job["status"] != "pending" and job["created"] < cutoff]:
+        del jobs[job_id]
+
+async def run_process_job(job_id: str, req: TextRequest, prompt: str, no_cache: bool) -> None:
+    job = jobs[job_id]
+    try:
+        job["result"] = await run_process(req, prompt, no_cache)
+        job["status"] = "done"
+    except HTTPException as e:
+        job["error"] = e.detail
+        job["status"] = "error"
+
+# Step 4: Enhanced text manipulation endpoint
+@app.post("/process")
+async def process_text(
+    req: TextRequest,
+    background_tasks: BackgroundTasks,
+    no_cache: bool = False,
+    background: bool = False,
+):
+    """Process text with various actions and styles"""
+    prompt = build_process_prompt(req)
+    if not background:
+        return await run_process(req, prompt, no_cache)
+
+    prune_jobs()
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {"status": "pending", "created": time.monotonic()}
+    background_tasks.add_task(run_process_job, job_id, req, prompt, no_cache)
+    return ORJSONResponse(status_code=202, content={"job_id": job_id, "status": "pending"})
+
+@app.get("/process/{job_id}")
+async def get_process_job(job_id: str):
+    """Poll a background /process job"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return {"job_id": job_id, **{k: v for k, v in job.items() if k != "created"}}
+
+@app.post("/process/stream")
+async def process_text_stream(req: TextRequest, no_cache: bool = False):
+    """Process text and stream the result as server-sent events"""
+    prompt = build_process_prompt(req)
+    cache_key = ResponseCache.make_key(req.action, req.style or "", req.text)
+    return StreamingResponse(
+        stream_gemini(prompt, cache_key, no_cache), media_type="text/event-stream"
+    )
 
 # Step 5: Generate new content endpoint
 @app.post("/generate")
-async def generate_content(req: GenerateRequest):
+async def generate_content(req: GenerateRequest, no_cache: bool = False):
     """Generate new content from a prompt"""
     
-    if not req.prompt.strip():
-        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
-    
-    try:
-        response = model.generate_content(req.prompt)
-        if not response.text:
-            raise HTTPException(status_code=500, detail="No content generated")
-        
-        logger.info("Successfully generated new content")
-        return {"result": response.text, "prompt": req.prompt}
-    
-    except Exception as e:
-        logger.error(f"Error generating content: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error generating content: {str(e)}")
+    async def produce() -> str:
+        response = await gemini_generate(req.prompt)
+        return response.text
+
+    cache_key = ResponseCache.make_key("generate", "", req.prompt)
+    result = await cached_single_flight(
+        cache_key, produce, "generating content", "No content generated", no_cache
+    )
+    logger.info("generated content")
+    return {"result": result, "prompt": req.prompt}
+
+@app.post("/generate/stream")
+async def generate_content_stream(req: GenerateRequest, no_cache: bool = False):
+    """Generate new content and stream it as server-sent events"""
+    cache_key = ResponseCache.make_key("generate", "", req.prompt)
+    return StreamingResponse(
+        stream_gemini(req.prompt, cache_key, no_cache), media_type="text/event-stream"
+    )
 
 # Step 6: Health check endpoint
 @app.get("/health")
@@ -117,104 +699,98 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "Gemini Canvas App"}
 
+# Step 6b: Response cache endpoints
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report response cache size and hit/miss counts"""
+    stats = response_cache.stats()
+    stats["inflight"] = len(single_flight)
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    return stats
+
+@app.post("/cache/clear")
+async def cache_clear():
+    """Drop all cached responses"""
+    await response_cache.clear()
+    if semantic_cache is not None:
+        await semantic_cache.clear()
+    return {"status": "cleared"}
+
 # Step 7: List available models endpoint
+MODELS_CACHE_TTL = 300
+_models_cache = {"exp": 0.0, "val": None}
+
+def fetch_model_names() -> list:
+    # list_models() is a blocking, paginated iterator
+    return [model.name for model in genai.list_models()]
+
 @app.get("/models")
 async def list_models():
     """List available Gemini models"""
+    now = time.monotonic()
+    if now < _models_cache["exp"]:
+        return _models_cache["val"]
     try:
-        models = genai.list_models()
-        model_names = [model.name for model in models]
-        return {"models": model_names}
+        model_names = await asyncio.to_thread(fetch_model_names)
+        _models_cache["val"] = {"models": model_names}
+        _models_cache["exp"] = now + MODELS_CACHE_TTL
+        return _models_cache["val"]
     except Exception as e:
-        logger.error(f"Error listing models: {str(e)}")
+        logger.error("Error listing models: %s", e)
         raise HTTPException(status_code=500, detail=f"Error listing models: {str(e)}")
 
 # Step 8: Simple frontend for testing
-@app.get("/", response_class=HTMLResponse)
-async def get_frontend():
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+INDEX_HTML = os.path.join(STATIC_DIR, "index.html")
+FRONTEND_CACHE_CONTROL = "public, max-age=3600"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison against a list of entity tags or *"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags:
+        return True
+    opaque = {tag[2:] if tag.startswith("W/") else tag for tag in tags}
+    return (etag[2:] if etag.startswith("W/") else etag) in opaque
+
+@app.get("/", response_class=FileResponse)
+async def get_frontend(request: Request):
     """Simple HTML frontend for testing the API"""
-    html_content = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Gemini Canvas App</title>
-        <style>
-            body { font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }
-            textarea { width: 100%; height: 200px; margin: 10px 0; }
-            button { padding: 10px 20px; margin: 5px; cursor: pointer; }
-            .result { background: #f5f5f5; padding: 15px; margin: 10px 0; border-radius: 5px; }
-            select { padding: 5px; margin: 5px; }
-        </style>
-    </head>
-    <body>
-        <h1>Gemini Canvas App</h1>
-        <div>
-            <h3>Process Text</h3>
-            <textarea id="inputText" placeholder="Enter your text here..."></textarea>
-            <div>
-                <label>Action:</label>
-                <select id="action">
-                    <option value="rewrite">Rewrite</option>
-                    <option value="summarize">Summarize</option>
-                    <option value="expand">Expand</option>
-                    <option value="improve">Improve</option>
-                    <option value="simplify">Simplify</option>
-                </select>
-                <label>Style:</label>
-                <select id="style">
-                    <option value="">Default</option>
-                    <option value="formal">Formal</option>
-                    <option value="casual">Casual</option>
-                    <option value="professional">Professional</option>
-                    <option value="creative">Creative</option>
-                </select>
-                <button onclick="processText()">Process</button>
-            </div>
-            <div id="result" class="result" style="display:none;"></div>
-        </div>
-        
-        <script>
-            async function processText() {
-                const text = document.getElementById('inputText').value;
-                const action = document.getElementById('action').value;
-                const style = document.getElementById('style').value;
-                
-                if (!text.trim()) {
-                    alert('Please enter some text');
-                    return;
-                }
-                
-                try {
-                    const response = await fetch('/process', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ text, action, style })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        document.getElementById('result').style.display = 'block';
-                        document.getElementById('result').innerHTML = `<strong>Result:</strong><br>${data.result}`;
-                    } else {
-                        alert('Error: ' + data.detail);
-                    }
-                } catch (error) {
-                    alert('Error: ' + error.message);
-                }
-            }
-        </script>
-    </body>
-    </html>
-    """
-    return html_content
+    response = FileResponse(
+        INDEX_HTML,
+        stat_result=os.stat(INDEX_HTML),
+        headers={"Cache-Control": FRONTEND_CACHE_CONTROL},
+    )
+    if etag_matches(request.headers.get("if-none-match"), response.headers["etag"]):
+        return Response(
+            status_code=304,
+            headers={"ETag": response.headers["etag"], "Cache-Control": FRONTEND_CACHE_CONTROL},
+        )
+    return response
 
 # Run the server
+# DEV=1 keeps the auto-reloading server. Otherwise run on uvloop and httptools (picked up by
+# "auto" when installed). WORKERS stays at 1 because the response caches and the background
+# job table live in process memory; extra workers would 404 job polls that reach another
+# process and /cache/clear would only clear one of them.
 if __name__ == "__main__":
-    uvicorn.run(
-        "gemini_canvas_app:app", 
-        host="127.0.0.1", 
-        port=8000, 
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    if os.getenv("DEV") == "1":
+        uvicorn.run(
+            "gemini_canvas_app:app",
+            host="127.0.0.1",
+            port=8000,
+            reload=True,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "gemini_canvas_app:app",
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8000")),
+            workers=int(os.getenv("WORKERS", "1")),
+            loop="auto",
+            http="auto",
+            access_log=False,
+        )
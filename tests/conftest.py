@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app refuses to import without a key; tests stub every Gemini call
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("GEMINI_WARMUP_TIMEOUT", "0.01")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,200 @@
+import asyncio
+import json
+
+import google.generativeai as genai
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from google.generativeai.types import generation_types
+
+import gemini_canvas_app as app_module
+
+protos = genai.protos
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class BlockedResponse:
+    @property
+    def text(self):
+        raise ValueError("response was blocked")
+
+
+def make_chunk(text=None, finish_reason=0, block_reason=0):
+    candidates = []
+    if not block_reason:
+        parts = [protos.Part(text=text)] if text else []
+        candidates = [protos.Candidate(content=protos.Content(parts=parts), finish_reason=finish_reason)]
+    return protos.GenerateContentResponse(
+        candidates=candidates,
+        prompt_feedback=protos.GenerateContentResponse.PromptFeedback(block_reason=block_reason),
+    )
+
+
+def stream_of(chunks):
+    async def iterator():
+        for chunk in chunks:
+            yield chunk
+
+    return generation_types.AsyncGenerateContentResponse.from_aiterator(iterator())
+
+
+@pytest.fixture
+def client():
+    asyncio.run(app_module.response_cache.clear())
+    with TestClient(app_module.app) as test_client:
+        yield test_client
+
+
+def test_single_flight_coalesces_identical_calls():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "text"
+
+    async def main():
+        flight = app_module.SingleFlight()
+        results = await asyncio.gather(*[flight.do("k", fn) for _ in range(10)])
+        return results, len(flight)
+
+    results, inflight = asyncio.run(main())
+    assert results == ["text"] * 10
+    assert calls == 1
+    assert inflight == 0
+
+
+def test_single_flight_fans_out_errors():
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        flight = app_module.SingleFlight()
+        return await asyncio.gather(*[flight.do("k", fn) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_single_flight_cancelled_leader_gives_followers_503():
+    async def fn():
+        await asyncio.sleep(10)
+
+    async def main():
+        flight = app_module.SingleFlight()
+        leader = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader_result, follower_result = asyncio.run(main())
+    assert isinstance(leader_result, asyncio.CancelledError)
+    assert isinstance(follower_result, HTTPException)
+    assert follower_result.status_code == 503
+
+
+def test_micro_batcher_maps_results_by_id(monkeypatch):
+    calls = []
+
+    async def fake_generate(prompt, **kwargs):
+        calls.append(prompt)
+        lines = prompt.split("\n")[1:]
+        items = [(int(n), json.loads(p)) for n, p in (line.split(". ", 1) for line in lines)]
+        # Reply out of order; ids must put each result back with its caller
+        return FakeResponse(json.dumps([{"id": i, "result": p.upper()} for i, p in reversed(items)]))
+
+    monkeypatch.setattr(app_module.model, "generate_content_async", fake_generate)
+
+    async def main():
+        batcher = app_module.MicroBatcher(max_size=4, max_wait=0.05)
+        batcher.start(["k"])
+        try:
+            return await asyncio.gather(*[batcher.submit("k", f"p{i}") for i in range(4)])
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(main()) == ["P0", "P1", "P2", "P3"]
+    assert len(calls) == 1
+
+
+def test_micro_batcher_fallback_isolates_failures(monkeypatch):
+    async def fake_generate(prompt, generation_config=None, **kwargs):
+        if generation_config:
+            return FakeResponse("not json")
+        if prompt == "blocked":
+            return BlockedResponse()
+        return FakeResponse(prompt.upper())
+
+    monkeypatch.setattr(app_module.model, "generate_content_async", fake_generate)
+
+    async def main():
+        batcher = app_module.MicroBatcher(max_size=3, max_wait=0.05)
+        batcher.start(["k"])
+        try:
+            return await asyncio.gather(
+                *[batcher.submit("k", p) for p in ("a", "blocked", "c")], return_exceptions=True
+            )
+        finally:
+            await batcher.stop()
+
+    first, second, third = asyncio.run(main())
+    assert (first, third) == ("A", "C")
+    assert isinstance(second, ValueError)
+
+
+def test_process_stream_success_is_cached(client, monkeypatch):
+    async def fake_generate(prompt, stream=False, **kwargs):
+        return await stream_of([make_chunk("hel"), make_chunk("lo", finish_reason=1)])
+
+    monkeypatch.setattr(app_module.model, "generate_content_async", fake_generate)
+
+    body = client.post("/process/stream", json={"text": "hi", "action": "expand"}).text
+    assert body.endswith("event: done\ndata: {}\n\n")
+    assert client.post("/process", json={"text": "hi", "action": "expand"}).json()["result"] == "hello"
+
+
+def test_process_stream_safety_stop_sends_error_and_skips_cache(client, monkeypatch):
+    async def fake_generate(prompt, stream=False, **kwargs):
+        if stream:
+            return await stream_of([make_chunk("partial "), make_chunk(finish_reason=3)])
+        return FakeResponse("full answer")
+
+    monkeypatch.setattr(app_module.model, "generate_content_async", fake_generate)
+
+    body = client.post("/process/stream", json={"text": "hi", "action": "expand"}).text
+    assert "event: error" in body
+    assert "event: done" not in body
+    assert client.post("/process", json={"text": "hi", "action": "expand"}).json()["result"] == "full answer"
+
+
+def test_background_job_can_be_polled(client, monkeypatch):
+    async def fake_generate(prompt, **kwargs):
+        return FakeResponse("done text")
+
+    monkeypatch.setattr(app_module.model, "generate_content_async", fake_generate)
+
+    response = client.post("/process?background=1", json={"text": "hi", "action": "rewrite"})
+    assert response.status_code == 202
+    job = client.get(f"/process/{response.json()['job_id']}").json()
+    assert job["status"] == "done"
+    assert job["result"]["result"] == "done text"
+    assert client.get("/process/missing").status_code == 404
+
+
+def test_frontend_revalidates_with_listed_weak_and_wildcard_etags(client):
+    response = client.get("/")
+    assert response.headers["cache-control"] == "public, max-age=3600"
+    etag = response.headers["etag"]
+    for header in (etag, f'"other", {etag}', f"W/{etag}", "*"):
+        revalidated = client.get("/", headers={"If-None-Match": header})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+    assert client.get("/", headers={"If-None-Match": '"other"'}).status_code == 200